@@ -5,9 +5,12 @@ import tempfile
 import os
 from pathlib import Path
 import time
-import base64
 from io import BytesIO
+import re
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 st.set_page_config(
     page_title="Document Translator",
@@ -22,6 +25,73 @@ LIBRE_TRANSLATE_INSTANCES = [
     "https://translate.terraprint.co"       # Public instance
 ]
 
+# Maximum characters per request to stay within API limits
+CHUNK_SIZE = 1000
+
+# Split after sentence-ending punctuation (Latin and CJK) and before line
+# breaks, keeping the following whitespace attached to the next sentence
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?。！？])(?=\s)|(?<=[。！？])(?=\S)|(?<=\S)(?=\n)')
+
+def split_into_chunks(text, max_chars=CHUNK_SIZE):
+    """Pack whole sentences into chunks of at most max_chars characters"""
+    chunks = []
+    current = ""
+    
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        if current and len(current) + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += sentence
+        
+        # Sentences longer than a whole chunk have to be cut, at the last
+        # whitespace if there is one so words stay whole
+        while len(current) > max_chars:
+            window = current[:max_chars + 1]
+            cut = max(window.rfind(" "), window.rfind("\n"))
+            if cut <= len(window) - len(window.lstrip()):
+                cut = max_chars
+            chunks.append(current[:cut])
+            current = current[cut:]
+    
+    if current:
+        chunks.append(current)
+    
+    # Whitespace-only chunks have nothing to translate, but the whitespace
+    # still separates paragraphs, so fold it into the previous chunk (or
+    # the next one at the start). It is stripped again before sending.
+    merged = []
+    pending = ""
+    for chunk in chunks:
+        if chunk.strip():
+            merged.append(pending + chunk)
+            pending = ""
+        elif merged:
+            merged[-1] += chunk
+        else:
+            pending += chunk
+    
+    return merged
+
+def translate_chunk_libre(session, instance, chunk, source, target_lang):
+    """Translate a single chunk on one LibreTranslate instance"""
+    payload = {
+        "q": chunk,
+        "source": source,
+        "target": target_lang,
+        "format": "text"
+    }
+    
+    headers = {"Content-Type": "application/json"}
+    
+    response = session.post(
+        f"{instance}/translate",
+        json=payload,
+        headers=headers,
+        timeout=30
+    )
+    response.raise_for_status()
+    return response.json().get("translatedText", "")
+
 def translate_text_libre(text, source_lang, target_lang="en"):
     """Translate text using LibreTranslate API"""
     
@@ -33,111 +103,158 @@ def translate_text_libre(text, source_lang, target_lang="en"):
     
     source = lang_map.get(source_lang, "auto")
     
-    # Split text into chunks of about 1000 characters to avoid request limits
-    chunks = []
-    for i in range(0, len(text), 1000):
-        chunks.append(text[i:i+1000])
+    # Split text on sentence boundaries into chunks that fit request limits
+    chunks = split_into_chunks(text)
     
-    translated_chunks = []
+    translated_chunks = [""] * len(chunks)
     progress_bar = st.progress(0)
     status_text = st.empty()
     
-    # Try different instances if one fails
-    instance_index = 0
-    current_instance = LIBRE_TRANSLATE_INSTANCES[instance_index]
+    max_retries = 3
+    update_every = max(1, len(chunks) // 100)
     
-    for i, chunk in enumerate(chunks):
-        status_text.text(f"Translating chunk {i+1}/{len(chunks)}")
+    # Instances that have failed during this call, shared by all workers
+    failed_instances = set()
+    instance_lock = threading.Lock()
+    
+    def pick_instance(n):
+        with instance_lock:
+            healthy = [
+                instance for instance in LIBRE_TRANSLATE_INSTANCES
+                if instance not in failed_instances
+            ]
         
-        # Skip empty chunks
-        if not chunk.strip():
-            translated_chunks.append("")
-            progress_bar.progress((i + 1) / len(chunks))
-            continue
+        # If every instance has failed, keep trying all of them
+        candidates = healthy or LIBRE_TRANSLATE_INSTANCES
+        return candidates[n % len(candidates)]
+    
+    def translate_one(chunk, idx):
+        # Keep the whitespace that separates this chunk from its neighbours
+        leading = chunk[:len(chunk) - len(chunk.lstrip())]
+        trailing = chunk[len(chunk.rstrip()):]
         
-        # Try to translate with current instance
-        max_retries = 3
+        # Spread chunks round-robin across the instances still working,
+        # moving on to the next one if the current instance fails
+        instance = None
         for retry in range(max_retries):
+            last_attempt = retry == max_retries - 1
+            if instance is None:
+                instance = pick_instance(idx + retry)
             try:
-                payload = {
-                    "q": chunk,
-                    "source": source,
-                    "target": target_lang,
-                    "format": "text"
-                }
-                
-                headers = {"Content-Type": "application/json"}
-                
-                response = requests.post(
-                    f"{current_instance}/translate",
-                    json=payload,
-                    headers=headers,
-                    timeout=30
+                translation = translate_chunk_libre(
+                    session,
+                    instance,
+                    chunk.strip(),
+                    source,
+                    target_lang
                 )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    translated_chunks.append(result.get("translatedText", ""))
-                    break
-                else:
-                    # If this instance fails, try another one
-                    instance_index = (instance_index + 1) % len(LIBRE_TRANSLATE_INSTANCES)
-                    current_instance = LIBRE_TRANSLATE_INSTANCES[instance_index]
-                    st.warning(f"Switching to alternative translation server... ({retry+1}/{max_retries})")
-                    time.sleep(1)  # Wait a bit before retrying
-                    
-            except Exception as e:
-                # If request fails, try another instance
-                instance_index = (instance_index + 1) % len(LIBRE_TRANSLATE_INSTANCES)
-                current_instance = LIBRE_TRANSLATE_INSTANCES[instance_index]
-                st.warning(f"Switching to alternative translation server... ({retry+1}/{max_retries})")
+                return leading + translation + trailing, True
+            except requests.HTTPError as e:
+                if e.response.status_code == 429:
+                    # Rate limited rather than down: back off and retry
+                    # the same instance
+                    if not last_attempt:
+                        time.sleep(2 ** (retry + 1))
+                    continue
+            except Exception:
+                pass
+            
+            with instance_lock:
+                failed_instances.add(instance)
+            instance = None
+            if not last_attempt:
                 time.sleep(1)  # Wait a bit before retrying
         
-        # Update progress
-        progress_bar.progress((i + 1) / len(chunks))
+        return leading + trailing, False
+    
+    # Share keep-alive connections between worker threads
+    with requests.Session() as session:
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        session.mount("https://", adapter)
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {
+                executor.submit(translate_one, chunk, i): i
+                for i, chunk in enumerate(chunks)
+            }
+            
+            # Streamlit calls must stay on the script thread
+            warned_instances = set()
+            try:
+                for done, future in enumerate(as_completed(futures), start=1):
+                    i = futures[future]
+                    translated_chunks[i], translated = future.result()
+                    
+                    if not translated:
+                        st.warning(f"Could not translate chunk {i+1} on any translation server")
+                    
+                    # Warn once per instance rather than once per chunk
+                    with instance_lock:
+                        newly_failed = failed_instances - warned_instances
+                    for instance in sorted(newly_failed):
+                        st.warning(f"Switching to alternative translation server... ({instance} is not responding)")
+                    warned_instances |= newly_failed
+                    
+                    # Update progress about once per percent
+                    if done % update_every == 0 or done == len(chunks):
+                        status_text.text(f"Translating chunk {done}/{len(chunks)}")
+                        progress_bar.progress(done / len(chunks))
+            except BaseException:
+                # Streamlit interrupts the script thread on rerun or Stop;
+                # drop queued chunks instead of sending them all first
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
     
     status_text.text("Translation complete!")
-    return '\n'.join(translated_chunks)
+    return ''.join(translated_chunks)
 
 # Functions to handle different file formats
 def extract_text_from_pdf(file):
     pdf_reader = PyPDF2.PdfReader(file)
-    text = ""
+    pages_text = []
     total_pages = len(pdf_reader.pages)
     
     progress_bar = st.progress(0)
     status_text = st.empty()
     
+    # Only refresh the UI about once per percent
+    update_every = max(1, total_pages // 100)
+    
     for i, page in enumerate(pdf_reader.pages):
-        status_text.text(f"Extracting text from page {i+1}/{total_pages}")
-        text += page.extract_text() + "\n\n"
-        progress_bar.progress((i + 1) / total_pages)
+        pages_text.append(page.extract_text() + "\n\n")
+        if i % update_every == 0 or i == total_pages - 1:
+            status_text.text(f"Extracting text from page {i+1}/{total_pages}")
+            progress_bar.progress((i + 1) / total_pages)
     
     status_text.text("Text extraction complete!")
-    return text
+    return "".join(pages_text)
 
 def extract_text_from_docx(file):
     doc = docx.Document(file)
-    text = ""
+    paragraphs_text = []
     total_paragraphs = len(doc.paragraphs)
     
     progress_bar = st.progress(0)
     status_text = st.empty()
     
+    # Only refresh the UI about once per percent
+    update_every = max(1, total_paragraphs // 100)
+    
     for i, para in enumerate(doc.paragraphs):
-        status_text.text(f"Extracting text from paragraph {i+1}/{total_paragraphs}")
-        text += para.text + "\n"
-        progress_bar.progress((i + 1) / total_paragraphs)
+        paragraphs_text.append(para.text + "\n")
+        if i % update_every == 0 or i == total_paragraphs - 1:
+            status_text.text(f"Extracting text from paragraph {i+1}/{total_paragraphs}")
+            progress_bar.progress((i + 1) / total_paragraphs)
     
     status_text.text("Text extraction complete!")
-    return text
+    return "".join(paragraphs_text)
 
 def extract_text_from_txt(file):
     return file.read().decode('utf-8')
 
 def save_docx(translated_text):
     doc = docx.Document()
-    for para in translated_text.split('\n'):
+    for para in translated_text.splitlines():
         if para.strip():
             doc.add_paragraph(para)
     